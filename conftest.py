@@ -0,0 +1,6 @@
+'''Command line options for the tests, defined at the root so they work from any directory'''
+
+
+def pytest_addoption(parser):
+    parser.addoption('--integration', action='store_true', default=False,
+                     help='Run tests against dropbox using DROPBOX_API_TOKEN')
@@ -5,25 +5,55 @@ file.py
 File operations on dropbox
 '''
 
-import re
 import os
 import io
 import hashlib
 import datetime
 import posixpath
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, NewType, Union, List, Dict
+from typing import Any, Optional, NewType, Union, List, Dict, Tuple
 
 import dropbox
-import requests
 import pandas as pd
 
 from .exceptions import DropboxFileError
 
+# Workbooks are read with the rust based calamine engine when it is
+# installed and pandas supports it (2.2+), otherwise with the pandas
+# default for the file type
+PANDAS_VERSION = tuple(int(v) for v in pd.__version__.split('.')[:2])
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE: Optional[str] = 'calamine' if PANDAS_VERSION >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Csv files asking for the pyarrow engine use the C engine without it
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
 
 # Constants
 
-TIME_FORMAT = '%Y%m%d_%H:%M'
+TIME_FORMAT = '%Y%m%d_%H:%M:%S'
+
+# Block size used by dropbox to compute content hashes
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Data at least this large is hashed on multiple threads
+PARALLEL_HASH_SIZE = 64 * 1024 * 1024
+
+# files_upload accepts at most 150MB, larger data is sent in chunks
+UPLOAD_SIZE_LIMIT = 150 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Dropbox commits at most 1000 upload sessions per batch
+UPLOAD_BATCH_SIZE = 1000
 
 
 # Dataclasses
@@ -35,6 +65,7 @@ class ExcelSheetConfig:
     cols: Optional[List[int]] = None
     col_names: Optional[Dict] = None
     index_col_name: Optional[str] = None
+    dtype: Optional[Dict] = None
 
 
 @dataclass
@@ -43,6 +74,8 @@ class CsvConfig:
     col_names: Optional[Dict] = None
     cols: Optional[List[int]] = None
     index_col_name: Optional[str] = None
+    engine: Optional[str] = None
+    dtype: Optional[Dict] = None
 
 
 DateTime = NewType('datetime.datetime', object)
@@ -52,6 +85,50 @@ ReadConfig = Union[List[ExcelSheetConfig], CsvConfig]
 # Files are always overwritten on dropbox
 WriteMode = dropbox.files.WriteMode('overwrite')
 
+# The client retries 5xx errors with exponential backoff and rate limited
+# requests after the Retry-After delay sent by dropbox
+MAX_RETRIES_ON_ERROR = 5
+MAX_RETRIES_ON_RATE_LIMIT = 5
+
+# Clients are shared per api token so connections are reused across files
+_CLIENTS: Dict[str, dropbox.Dropbox] = {}
+
+
+def get_client(api_token: Optional[str] = None) -> dropbox.Dropbox:
+    '''
+    ARGS:
+        api_token: Dropbox API token, read from DROPBOX_API_TOKEN if not set
+
+    Returns the shared dropbox client for the api token
+    '''
+    api_token = os.environ.get('DROPBOX_API_TOKEN') if api_token is None else api_token
+    if api_token not in _CLIENTS:
+        _CLIENTS[api_token] = dropbox.Dropbox(
+            api_token,
+            max_retries_on_error=MAX_RETRIES_ON_ERROR,
+            max_retries_on_rate_limit=MAX_RETRIES_ON_RATE_LIMIT
+        )
+    return _CLIENTS[api_token]
+
+
+def _dropbox_content_hash(data: bytes) -> str:
+    # sha256 of the concatenated sha256 digests of each 4MB block
+    view = memoryview(data)
+    blocks = [view[i:i + HASH_BLOCK_SIZE] for i in range(0, len(view), HASH_BLOCK_SIZE)]
+
+    if len(view) >= PARALLEL_HASH_SIZE:
+        # hashlib releases the GIL, so blocks are hashed in parallel by threads
+        with ThreadPoolExecutor() as executor:
+            block_digests = list(executor.map(_sha256_digest, blocks))
+    else:
+        block_digests = list(map(_sha256_digest, blocks))
+
+    return hashlib.sha256(b''.join(block_digests)).hexdigest()
+
+
+def _sha256_digest(block: memoryview) -> bytes:
+    return hashlib.sha256(block).digest()
+
 
 class Base:
     '''
@@ -67,10 +144,13 @@ class Base:
         move: Moves path to a destination file path
         copy: Self explanatory
         delete: Remove the file from dropbox folder
+        clear_cache: Forget cached metadata
 
     Base class for all dropbox file instances
     '''
 
+    __slots__ = ('_path', '_client', '_last_modified', '_content_hash')
+
     def __init__(
             self,
             path: str,
@@ -90,7 +170,7 @@ class Base:
         return self.path < other.path
 
     def __hash__(self):
-        return int(hashlib.md5(self._path.encode('utf8')).hexdigest(), 16)
+        return hash(self._path)
 
     def __repr__(self):
         return '{class_name}(path={path}, last_modified={last_modified}, content_hash={content_hash})'.format(
@@ -125,23 +205,31 @@ class Base:
             self.update_metadata()
         return self._content_hash
 
-    def exists(self) -> bool:
+    def exists(self, force: bool = False) -> bool:
         '''
+        ARGS:
+            force: Check dropbox even if the file metadata is already known
+
         RETURNS:
             bool value indicating if file exists
 
         Check whether the file exits on dropbox
         '''
-        try:
-            self.update_metadata()
+        if self._last_modified is not None and not force:
             return True
-        except Exception as err:
-            if isinstance(err, dropbox.exceptions.ApiError) and\
-               isinstance(err.error, dropbox.files.GetMetadataError) and\
-               isinstance(err.error.get_path, LookupError):  # File doesn't exist
+
+        try:
+            metadata = self._client.files_get_metadata(self._path)
+            self._set_metadata(metadata)
+        except dropbox.exceptions.ApiError as err:
+            if isinstance(err.error, dropbox.files.GetMetadataError) and\
+               err.error.is_path() and err.error.get_path().is_not_found():  # File doesn't exist
                 return False
-            else:
-                raise DropboxFileError(err)
+            raise DropboxFileError(err)
+        except Exception as err:
+            raise DropboxFileError(err)
+
+        return True
 
     def upload(self, data: bytes, timestamp: bool = False):
         '''
@@ -149,8 +237,13 @@ class Base:
             data: bytes to be uploaded to path
             timestamp: boolean indicating whether to attach timestamp to uploaded file
 
-        Uploads data in bytes to a filepath
+        Uploads data in bytes to a filepath. The upload is skipped if
+        the file is known to have the same content already
         '''
+        if timestamp is False and self._content_hash is not None and\
+           self._content_hash == _dropbox_content_hash(data):
+            return
+
         if timestamp is True:
             filename = datetime.datetime.utcnow().strftime(
                 TIME_FORMAT) + posixpath.basename(self._path)
@@ -158,8 +251,9 @@ class Base:
                 posixpath.dirname(self._path), filename)
 
         try:
-            self._client.files_upload(data, self._path, mode=WriteMode)
-            self.update_metadata()
+            metadata = self._client.files_upload(data, self._path, mode=WriteMode)\
+                if len(data) <= UPLOAD_SIZE_LIMIT else self._upload_session(data)
+            self._set_metadata(metadata)
         except Exception as err:
             raise DropboxFileError(err)
 
@@ -170,11 +264,13 @@ class Base:
 
         Download data in bytes from path on dropbox
         '''
+        response = self._download_stream()
         try:
-            link = self._client.files_get_temporary_link(self._path).link
-            return requests.get(link).content
+            return response.content
         except Exception as err:
             raise DropboxFileError(err)
+        finally:
+            response.close()
 
     def move(self, dest: str) -> None:
         '''
@@ -184,10 +280,10 @@ class Base:
         Move file to destination path
         '''
         try:
-            self._client.files_move_v2(self._path, dest)
-            self.update_metadata(path=dest)
+            result = self._client.files_move_v2(self._path, dest)
+            self._set_metadata(result.metadata)
         except Exception as err:
-            DropboxFileError(err)
+            raise DropboxFileError(err)
 
     def copy(self, dest: str) -> None:
         '''
@@ -199,7 +295,7 @@ class Base:
         try:
             self._client.files_copy_v2(self._path, dest)
         except Exception as err:
-            DropboxFileError(err)
+            raise DropboxFileError(err)
 
     def delete(self):
         '''
@@ -207,8 +303,9 @@ class Base:
         '''
         try:
             self._client.files_delete_v2(self._path)
+            self.clear_cache()
         except Exception as err:
-            DropboxFileError(err)
+            raise DropboxFileError(err)
 
     def update_metadata(self, path=None):
         '''
@@ -221,18 +318,55 @@ class Base:
         try:
             self._path = path if path is not None else self._path
             metadata = self._client.files_get_metadata(self._path)
-            self._path = metadata.path_lower
-            self._last_modified = metadata.client_modified
-            self._content_hash = metadata.content_hash
+            self._set_metadata(metadata)
         except Exception as err:
             raise DropboxFileError(err)
 
+    def _upload_session(self, data: bytes) -> dropbox.files.FileMetadata:
+        first_chunk = data[:UPLOAD_CHUNK_SIZE]
+        session = self._client.files_upload_session_start(first_chunk)
+        cursor = dropbox.files.UploadSessionCursor(session.session_id, len(first_chunk))
+
+        while len(data) - cursor.offset > UPLOAD_CHUNK_SIZE:
+            self._client.files_upload_session_append_v2(
+                data[cursor.offset:cursor.offset + UPLOAD_CHUNK_SIZE], cursor)
+            cursor.offset += UPLOAD_CHUNK_SIZE
+
+        commit = dropbox.files.CommitInfo(path=self._path, mode=WriteMode)
+        return self._client.files_upload_session_finish(data[cursor.offset:], cursor, commit)
+
+    def _download_stream(self):
+        # Response body is read lazily from response.raw, caller closes it
+        try:
+            _, response = self._client.files_download(self._path)
+        except Exception as err:
+            raise DropboxFileError(err)
+        response.raw.decode_content = True
+        # Keep the stream open at EOF so file wrappers can finish reading
+        response.raw.auto_close = False
+        return response
+
+    def clear_cache(self):
+        '''
+        Forget the cached metadata so it is fetched again on next access
+        '''
+        self._last_modified = None
+        self._content_hash = None
+
+    def _set_metadata(self, metadata: dropbox.files.FileMetadata):
+        # Upload and move return the file metadata, so no extra call is needed
+        self._path = metadata.path_lower
+        self._last_modified = metadata.client_modified
+        self._content_hash = metadata.content_hash
+
 
 class DropboxTextFile(Base):
     '''
     Text file as encoding string desribed by attribute
     '''
 
+    __slots__ = ('_encoding',)
+
     def __init__(self, *args, encoding: str = 'utf8', **kwargs):
         self._encoding = encoding
         super().__init__(*args, **kwargs)
@@ -250,6 +384,8 @@ class DropboxCsvFile(Base):
     Csv file as dataframe with utf-8 encoded text
     '''
 
+    __slots__ = ('_encoding',)
+
     def __init__(self, *args, encoding: str = 'utf8', **kwargs):
         self._encoding = encoding
         super().__init__(*args, **kwargs)
@@ -261,27 +397,43 @@ class DropboxCsvFile(Base):
 
         Returns a pandas dataframe with set encoding
         '''
-        data = super().download()
-        buffer = io.StringIO(data.decode(self._encoding))
-        return self._read_file(buffer, csv_config)
+        # Parse straight from the response stream instead of a full copy in memory
+        response = self._download_stream()
+        try:
+            # newline='' leaves line endings inside quoted fields to the parser
+            buffer = io.TextIOWrapper(response.raw, encoding=self._encoding, newline='')
+            return self._read_file(buffer, csv_config)
+        except DropboxFileError:
+            raise
+        except Exception as err:
+            raise DropboxFileError(err)
+        finally:
+            response.close()
 
     @staticmethod
     def _read_file(buffer, config: CsvConfig) -> pd.DataFrame:
-        df = pd.read_csv(buffer, header=config.header, usecols=config.cols)
-        df.columns = df.columns.map(lambda c: c.strip())
+        engine = None if config.engine == 'pyarrow' and not HAS_PYARROW else config.engine
+        if engine == 'pyarrow':
+            # The pyarrow engine only selects columns by name
+            df = pd.read_csv(buffer, header=config.header, dtype=config.dtype, engine='pyarrow')
+            df = df.iloc[:, sorted(set(config.cols))] if config.cols is not None else df
+        else:
+            df = pd.read_csv(buffer, header=config.header, usecols=config.cols,
+                             dtype=config.dtype, engine=engine)
+        if df.columns.inferred_type != 'string':  # e.g. numeric header cells
+            df.columns = df.columns.astype(str)
+        df.columns = df.columns.str.strip()
 
         if config.col_names:
-            try:
-                assert sorted(df.columns) == sorted(config.col_names.keys())
-            except AssertionError:
+            if set(df.columns) != config.col_names.keys():
                 raise DropboxFileError('Expected cols - {}, recieved - {}'.format(
-                    list(df.columns),
-                    list(config.col_names.keys())
+                    list(config.col_names.keys()),
+                    list(df.columns)
                 ))
 
-            df = df.rename(columns=config.col_names)
-        df = df.set_index(
-            config.index_col_name) if config.index_col_name else df
+            df.rename(columns=config.col_names, inplace=True)
+        if config.index_col_name:
+            df.set_index(config.index_col_name, inplace=True)
         return df
 
 
@@ -290,6 +442,8 @@ class DropboxExcelFile(Base):
     Excel file as a list of dataframes
     '''
 
+    __slots__ = ()
+
     def download(self, sheet_config_list: List[ExcelSheetConfig]) -> List[pd.DataFrame]:
         '''
         ARGS:
@@ -298,27 +452,28 @@ class DropboxExcelFile(Base):
         Returns a list of dataframes for each sheet
         '''
         data = super().download()
-        buffer = io.BytesIO(data)
-        return list(map(lambda c: self._read_sheet(buffer, c), sheet_config_list))
+        # The workbook is opened once and each sheet parsed from it
+        with pd.ExcelFile(io.BytesIO(data), engine=EXCEL_ENGINE) as workbook:
+            return [self._read_sheet(workbook, c) for c in sheet_config_list]
 
     @staticmethod
-    def _read_sheet(buffer, config: ExcelSheetConfig) -> pd.DataFrame:
-        df = pd.read_excel(buffer, config.sheet_name,
-                           header=config.header, usecols=config.cols)
-        df.columns = df.columns.map(lambda c: c.strip())
+    def _read_sheet(workbook: pd.ExcelFile, config: ExcelSheetConfig) -> pd.DataFrame:
+        df = workbook.parse(config.sheet_name, header=config.header,
+                            usecols=config.cols, dtype=config.dtype)
+        if df.columns.inferred_type != 'string':  # e.g. numeric header cells
+            df.columns = df.columns.astype(str)
+        df.columns = df.columns.str.strip()
 
         if config.col_names:
-            try:
-                assert sorted(df.columns) == sorted(config.col_names.keys())
-            except AssertionError:
+            if set(df.columns) != config.col_names.keys():
                 raise DropboxFileError('Expected cols - {}, recieved - {}'.format(
-                    list(df.columns),
-                    list(config.col_names.keys())
+                    list(config.col_names.keys()),
+                    list(df.columns)
                 ))
 
-            df = df.rename(columns=config.col_names)
-        df = df.set_index(
-            config.index_col_name) if config.index_col_name else df
+            df.rename(columns=config.col_names, inplace=True)
+        if config.index_col_name:
+            df.set_index(config.index_col_name, inplace=True)
         return df
 
 
@@ -326,32 +481,114 @@ class DropboxExcelFile(Base):
 
 File = Union[DropboxExcelFile, DropboxCsvFile, DropboxTextFile]
 
+# Files with any other extension are treated as text
+EXTENSION_TO_FILETYPE = {
+    '.xlsx': DropboxExcelFile,
+    '.xls': DropboxExcelFile,
+    '.csv': DropboxCsvFile
+}
+
 
-def make_dropbox_file(file: Union[str, dropbox.files.FileMetadata], api_token: Optional[str] = None) -> File:
+def make_dropbox_file(
+        file: Union[str, dropbox.files.FileMetadata],
+        api_token: Optional[str] = None,
+        last_modified: Optional[datetime.datetime] = None,
+        content_hash: Optional[str] = None
+) -> File:
     '''
     ARGS:
         file: A metadata object or filepath
         api_token: Dropbox API token
+        last_modified: (optional) Known last modified time if file is a filepath
+        content_hash: (optional) Known content hash if file is a filepath
 
     Create an instance of dropbox file
     '''
-    client = dropbox.Dropbox(os.environ.get(
-        'DROPBOX_API_TOKEN')) if api_token is None else dropbox.Dropbox(api_token)
-
-    pattern_to_filetype = [
-        (DropboxExcelFile, r'^.+\.xlsx?$'),
-        (DropboxCsvFile,   r'^.+\.csv$'),
-        (DropboxTextFile,  r'^.+$')
-    ]
+    client = get_client(api_token)
 
     if isinstance(file, dropbox.files.FileMetadata):
         path = file.path_lower
         last_modified = file.client_modified
         content_hash = file.content_hash
-        instance = next(Class(path, client, last_modified=last_modified, content_hash=content_hash)
-                        for Class, regex in pattern_to_filetype if re.match(regex, path))
     else:
-        instance = next(Class(file, client) for Class,
-                        regex in pattern_to_filetype if re.match(regex, file))
+        path = file
+
+    Class = EXTENSION_TO_FILETYPE.get(posixpath.splitext(path)[1].lower(), DropboxTextFile)
+    return Class(path, client, last_modified=last_modified, content_hash=content_hash)
+
+
+# Bulk operations
+
+def download_many(files: List[File], configs: Optional[List[Any]] = None, max_workers: int = 8) -> List:
+    '''
+    ARGS:
+        files: List of dropbox file instances
+        configs: (optional) Read config for each file, None for text files
+        max_workers: Number of downloads in flight at once
+
+    Download several files concurrently. Results are returned in the
+    same order as files
+    '''
+    if configs is not None and len(configs) != len(files):
+        raise ValueError('Expected {} configs, recieved {}'.format(len(files), len(configs)))
+    configs = [None] * len(files) if configs is None else configs
+
+    def download(file, config):
+        return file.download() if config is None else file.download(config)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(download, files, configs))
+
+
+def upload_many(files_and_data: List[Tuple[File, bytes]], max_workers: int = 8) -> None:
+    '''
+    ARGS:
+        files_and_data: List of (dropbox file instance, bytes to upload) pairs
+        max_workers: Number of uploads in flight at once
+
+    Upload several small files (150MB or less each). The data is sent
+    concurrently and the files of each account are committed together
+    in batches
+    '''
+    for file, data in files_and_data:
+        if len(data) > UPLOAD_SIZE_LIMIT:
+            raise DropboxFileError('{} is larger than {} bytes, upload it on its own'.format(
+                file.path, UPLOAD_SIZE_LIMIT))
+
+    # A batch is committed by a single client, so files are grouped by theirs
+    by_client: Dict[dropbox.Dropbox, List[Tuple[File, bytes]]] = {}
+    for file, data in files_and_data:
+        by_client.setdefault(file._client, []).append((file, data))
+
+    for client, client_files in by_client.items():
+        for i in range(0, len(client_files), UPLOAD_BATCH_SIZE):
+            _upload_batch(client, client_files[i:i + UPLOAD_BATCH_SIZE], max_workers)
+
+
+def _upload_batch(client: dropbox.Dropbox, batch: List[Tuple[File, bytes]], max_workers: int) -> None:
+
+    def start_session(file_and_data):
+        file, data = file_and_data
+        session = client.files_upload_session_start(data, close=True)
+        return dropbox.files.UploadSessionFinishArg(
+            cursor=dropbox.files.UploadSessionCursor(session.session_id, len(data)),
+            commit=dropbox.files.CommitInfo(path=file.path, mode=WriteMode)
+        )
 
-    return instance
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = list(executor.map(start_session, batch))
+        result = client.files_upload_session_finish_batch_v2(entries)
+    except Exception as err:
+        raise DropboxFileError(err)
+
+    # Files committed alongside a failed one are still updated before raising
+    failed = []
+    for (file, _), entry in zip(batch, result.entries):
+        if entry.is_failure():
+            failed.append('{} - {}'.format(file.path, entry.get_failure()))
+        else:
+            file._set_metadata(entry.get_success())
+
+    if failed:
+        raise DropboxFileError('Failed to upload {} files: {}'.format(len(failed), ', '.join(failed)))
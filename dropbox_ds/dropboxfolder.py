@@ -4,13 +4,14 @@ state
 '''
 
 import os
-import hashlib
+import json
+import datetime
 import posixpath
 from typing import Optional, List, Tuple
 
 import dropbox
 
-from .dropboxfile import make_dropbox_file
+from .dropboxfile import get_client, make_dropbox_file
 from .exceptions import DropboxFolderError
 
 
@@ -23,20 +24,32 @@ class DropboxFolder:
     Methods:
         create: Creates an empty folder with the name
         update: Refresh the state of the folder
+        reset: Forget the cursor so the next update lists the folder again
         delete: Deletes the folder
+
+    If state_path is set, the cursor and file list are saved there after
+    each update and restored on init, so that after a restart only the
+    changes since the last update are listed. A state file saved for
+    another folder raises DropboxFolderError
     '''
 
-    def __init__(self, folder: str, api_token: Optional[str] = None):
+    __slots__ = ('_api_token', '_client', '_path', '_cursor', '_flist', '_state_path')
+
+    def __init__(self, folder: str, api_token: Optional[str] = None, state_path: Optional[str] = None):
         self._api_token = api_token if api_token is not None else os.environ.get(
             'DROPBOX_API_TOKEN')
-        self._client = dropbox.Dropbox(self._api_token)
+        self._client = get_client(self._api_token)
         self._path = folder.path_lower if isinstance(
             folder, dropbox.files.FileMetadata) else folder
         self._cursor = ''
         self._flist = []
+        self._state_path = state_path
+
+        if state_path is not None and os.path.exists(state_path):
+            self._load_state()
 
     def __hash__(self):
-        return int(hashlib.md5(self._path.encode('utf8')).hexdigest(), 16)
+        return hash(self._path)
 
     def __eq__(self, other):
         return self._path == other.path
@@ -84,10 +97,21 @@ class DropboxFolder:
         '''
         cursor, changes = self._get_changes_from_path(
         ) if self._cursor == '' else self._get_changes_from_cursor()
-        flist = self._get_files(changes)
-        self._flist = flist
+        if changes:
+            self._flist = self._get_files(changes)
         self._cursor = cursor
 
+        if self._state_path is not None:
+            self._save_state()
+
+    def reset(self) -> None:
+        '''
+        Clears the cursor and file list, the next update
+        lists the folder from scratch
+        '''
+        self._cursor = ''
+        self._flist = []
+
     def delete(self) -> None:
         '''
         Deletes the folder with path
@@ -100,26 +124,16 @@ class DropboxFolder:
     def _get_changes_from_cursor(self) -> Tuple[str, List]:
         try:
             result = self._client.files_list_folder_continue(self._cursor)
+        except dropbox.exceptions.ApiError as err:
+            if isinstance(err.error, dropbox.files.ListFolderContinueError) and\
+               err.error.is_reset():  # Cursor expired, list the folder again
+                self.reset()
+                return self._get_changes_from_path()
+            raise DropboxFolderError(err)
         except Exception as err:
             raise DropboxFolderError(err)
 
-        flist = []
-
-        def process_entries(entries):
-            for e in entries:
-                flist.append(e)
-
-        process_entries(result.entries)
-
-        while result.has_more:
-            try:
-                result = self._client.files_list_folder_continue(result.cursor)
-            except Exception as err:
-                raise DropboxFolderError(err)
-
-            process_entries(result.entries)
-
-        return result.cursor, flist
+        return self._get_remaining_pages(result)
 
     def _get_changes_from_path(self) -> Tuple[str, List]:
         try:
@@ -127,13 +141,10 @@ class DropboxFolder:
         except Exception as err:
             raise DropboxFolderError(err)
 
-        flist = []
-
-        def process_entries(entries):
-            for e in entries:
-                flist.append(e)
+        return self._get_remaining_pages(result)
 
-        process_entries(result.entries)
+    def _get_remaining_pages(self, result: dropbox.files.ListFolderResult) -> Tuple[str, List]:
+        entries = list(result.entries)
 
         while result.has_more:
             try:
@@ -141,22 +152,65 @@ class DropboxFolder:
             except Exception as err:
                 raise DropboxFolderError(err)
 
-            process_entries(result.entries)
+            entries.extend(result.entries)
 
-        return result.cursor, flist
+        return result.cursor, entries
 
     def _get_files(self, folder_content: List) -> List:
         # Folders and Moved or deleted files are ignored. Files within subfolders are also ignored
-        files = [f for f in folder_content if isinstance(f, dropbox.files.FileMetadata)]
-
-        deleted_paths = [f.path_lower for
-                         f in folder_content if isinstance(f, dropbox.files.DeletedMetadata)]
+        deleted_paths = {f.path_lower for
+                         f in folder_content if isinstance(f, dropbox.files.DeletedMetadata)}
+
+        files = {f.path: f for
+                 f in self._flist
+                 if f.path not in deleted_paths and
+                 posixpath.dirname(f.path) == self._path}
+
+        for f in folder_content:
+            if isinstance(f, dropbox.files.FileMetadata) and\
+               posixpath.dirname(f.path_lower) == self._path:
+                files[f.path_lower] = make_dropbox_file(f, self._api_token)
+
+        return list(files.values())
+
+    def _save_state(self) -> None:
+        state = {
+            'path': self._path,
+            'cursor': self._cursor,
+            'files': [{
+                'path': f.path,
+                'last_modified': f.last_modified.isoformat(),
+                'content_hash': f.content_hash
+            } for f in self._flist]
+        }
+
+        # Written to a temporary file first so the state is never left half written
+        tmp_path = self._state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._state_path)
+        except OSError as err:
+            raise DropboxFolderError(err)
 
-        files_added_or_modified = [make_dropbox_file(f, self._api_token) for
-                                   f in files if self._path == posixpath.dirname(f.path_lower)]
-        files_unchanged = [f for
-                           f in self._flist
-                           if f.path not in deleted_paths and
-                           posixpath.dirname(f.path) == self.path]
+    def _load_state(self) -> None:
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as err:
+            raise DropboxFolderError(err)
 
-        return list(set(files_unchanged).union(files_added_or_modified))
+        try:
+            if state['path'] != self._path:
+                raise DropboxFolderError('State in {} belongs to {}, not {}'.format(
+                    self._state_path, state['path'], self._path))
+
+            self._cursor = state['cursor']
+            self._flist = [make_dropbox_file(
+                f['path'],
+                self._api_token,
+                last_modified=datetime.datetime.fromisoformat(f['last_modified']),
+                content_hash=f['content_hash']
+            ) for f in state['files']]
+        except (KeyError, TypeError, ValueError) as err:
+            raise DropboxFolderError('Invalid state in {} - {}'.format(self._state_path, err))
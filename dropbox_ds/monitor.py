@@ -4,14 +4,27 @@ monitor
 '''
 
 import time
+import random
 import logging
-from typing import Callable, Optional, List
+from typing import Callable, Optional, List, Tuple
 
-from . import exceptions, folder
+import dropbox
+
+from . import exceptions, dropboxfolder
+from .dropboxfile import get_client
 
 
 LOGGER = logging.getLogger('dropboxutils')
 
+# Seconds a longpoll request waits for changes, dropbox allows 30 - 480
+LONGPOLL_TIMEOUT = 120
+
+# Seconds to wait after a failed longpoll or update, doubled on each consecutive failure.
+# Up to half the delay again is added at random so that several monitors
+# failing together do not retry in lockstep
+ERROR_DELAY = 1
+MAX_ERROR_DELAY = 60
+
 
 class DropboxMonitor():
     '''
@@ -26,23 +39,57 @@ class DropboxMonitor():
     def __init__(self, path: str, emit_function: Callable, logger: Optional[logging.Logger] = None):
         self._logger = logging.getLogger(
             'dropboxutils') if logger is None else logger
-        self._folder = folder.DropboxFolder(path)
+        self._folder = dropboxfolder.DropboxFolder(path)
+        self._client = get_client()
         self._emitter = emit_function
 
     def watch(self):
+        '''
+        Blocks on dropbox longpoll and emits the folder state
+        whenever its contents change
+        '''
+        delay = ERROR_DELAY
         while True:
             try:
-                self._folder.update()
-                flist = self._folder.flist()
-                cursor = self._folder.cursor()
-                self._publish(flist, cursor)
-            except exceptions.DropboxFolder as err:
+                changed = self._poll()
+            except (exceptions.DropboxFolderError, exceptions.DropboxMonitorError) as err:
                 self._logger.warning(err)
-            finally:
-                time.sleep(1)
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, MAX_ERROR_DELAY)
+                continue
+
+            delay = ERROR_DELAY
+            if changed:
+                self.emit(self._folder.flist, self._folder.cursor)
 
     def emit(self, flist: List, cursor: str):
         try:
             self._emitter(cursor, flist)
         except Exception as err:
             raise exceptions.DropboxMonitorError(err)
+
+    def _poll(self) -> bool:
+        # Returns True if the folder was updated with new changes
+        if self._folder.cursor == '':
+            self._folder.update()
+
+        changes, backoff = self._wait_for_changes()
+        if changes:
+            self._folder.update()
+        if backoff:
+            time.sleep(backoff)
+        return changes
+
+    def _wait_for_changes(self) -> Tuple[bool, Optional[int]]:
+        try:
+            result = self._client.files_list_folder_longpoll(
+                self._folder.cursor, timeout=LONGPOLL_TIMEOUT)
+        except dropbox.exceptions.ApiError as err:
+            if isinstance(err.error, dropbox.files.ListFolderLongpollError) and\
+               err.error.is_reset():  # Cursor expired, list the folder again
+                self._folder.reset()
+                return True, None
+            raise exceptions.DropboxMonitorError(err)
+        except Exception as err:
+            raise exceptions.DropboxMonitorError(err)
+        return result.changes, result.backoff
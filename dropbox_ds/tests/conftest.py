@@ -2,13 +2,16 @@
 
 import os
 import io
+import functools
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 import posixpath
-from typing import Callable, Dict
-import dropbox
+from typing import Callable, Dict, Tuple
 
+import dropbox
 import pandas as pd
 from .. import dropboxfolder, dropboxfile
+from .mock_client import MockDropbox
 
 
 @pytest.fixture(scope='session')
@@ -16,66 +19,105 @@ def api_token():
     return os.environ.get('DROPBOX_API_TOKEN')
 
 
+@pytest.fixture(scope='session', autouse=True)
+def mock_dropbox(request):
+    # Tests use the in-memory client unless run with --integration
+    if request.config.getoption('integration'):
+        yield
+        return
+
+    # pytest.MonkeyPatch.context needs pytest 6.2, the session patch is undone by hand
+    mp = MonkeyPatch()
+    mp.setattr(dropbox, 'Dropbox', MockDropbox)
+    mp.setattr(dropboxfile, '_CLIENTS', {})
+    yield
+    mp.undo()
+
+
+@pytest.fixture(scope='function')
+def mock_client(request, api_token):
+    # For tests that inject failures into the in-memory client
+    if request.config.getoption('integration'):
+        pytest.skip('Needs the in-memory dropbox client')
+    return dropboxfile.get_client(api_token)
+
+
 @pytest.fixture(scope='session')
 def client(api_token):
-    return dropbox.Dropbox(api_token)
+    return dropboxfile.get_client(api_token)
 
 
-@pytest.fixture(scope='function')
-def folder_instance(api_token):
-    dirpath = '/ai/test'
+def make_test_folder(api_token):
+    # Each pytest-xdist worker gets its own folder so parallel runs do not collide
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    dirpath = '/ai/test' if worker is None else '/ai/test-{}'.format(worker)
     folder_obj = dropboxfolder.DropboxFolder(dirpath, api_token)
     folder_obj.create()
     yield folder_obj
     folder_obj.delete()
 
 
+@pytest.fixture(scope='module')
+def module_folder(api_token):
+    # For tests that do not depend on the folder being empty
+    yield from make_test_folder(api_token)
+
+
+@pytest.fixture(scope='function')
+def folder_instance(api_token):
+    yield from make_test_folder(api_token)
+
+
 # File factory
 
+@functools.lru_cache(maxsize=None)
+def make_payload(file_type: type) -> Tuple:
+    # Payloads are not mutated by tests, so each type is built once per session
+    if file_type is dropboxfile.DropboxCsvFile:
+        original_data = pd.DataFrame({
+            'a': [1, 2, 3],
+            'b': [4, 5, 6],
+            'c': [7, 8, 9]
+        })
+
+        bytes_data = original_data.to_csv().encode('utf8')
+
+    elif file_type is dropboxfile.DropboxExcelFile:
+        sheet_1 = pd.DataFrame({
+            'a': [1, 2, 3],
+            'b': [4, 5, 6],
+            'c': [7, 8, 9]
+        })
+        sheet_2 = pd.DataFrame({
+            'd': [10, 11, 12],
+            'e': [13, 14, 15],
+            'f': [16, 17, 18]
+        })
+
+        io_instance = io.BytesIO()
+
+        with pd.ExcelWriter(io_instance) as writer:
+            sheet_1.to_excel(writer, sheet_name='sheet_1')
+            sheet_2.to_excel(writer, sheet_name='sheet_2')
+
+        original_data = sheet_1.merge(
+            sheet_2, how='outer', left_index=True, right_index=True)
+        bytes_data = io_instance.getvalue()
+
+    else:
+        original_data = 'This is text data'
+        bytes_data = bytes(original_data, encoding='utf8')
+
+    return original_data, bytes_data
+
+
 @pytest.fixture(scope='function')
 def dropbox_file(folder_instance, api_token) -> Callable:
 
     def make_dropbox_file(filename) -> Dict:
         path = posixpath.join(folder_instance.path, filename)
         file_instance = dropboxfile.make_dropbox_file(path)
-
-        if isinstance(file_instance, dropboxfile.DropboxTextFile):
-            original_data = 'This is text data'
-            bytes_data = bytes(original_data, encoding='utf8')
-
-        elif isinstance(file_instance, dropboxfile.DropboxCsvFile):
-            original_data = pd.DataFrame({
-                'a': [1, 2, 3],
-                'b': [4, 5, 6],
-                'c': [7, 8, 9]
-            })
-
-            io_instance = io.StringIO()
-            original_data.to_csv(io_instance)
-            bytes_data = bytes(io_instance.getvalue(), encoding='utf8')
-
-        elif isinstance(file_instance, dropboxfile.DropboxExcelFile):
-            sheet_1 = pd.DataFrame({
-                'a': [1, 2, 3],
-                'b': [4, 5, 6],
-                'c': [7, 8, 9]
-            })
-            sheet_2 = pd.DataFrame({
-                'd': [10, 11, 12],
-                'e': [13, 14, 15],
-                'f': [16, 17, 18]
-            })
-
-            io_instance = io.BytesIO()
-
-            with pd.ExcelWriter(io_instance) as writer:
-                sheet_1.to_excel(writer, sheet_name='sheet_1')
-                sheet_2.to_excel(writer, sheet_name='sheet_2')
-
-            original_data = sheet_1.merge(
-                sheet_2, how='outer', left_index=True, right_index=True)
-            bytes_data = io_instance.getvalue()
-
+        original_data, bytes_data = make_payload(type(file_instance))
         return {'file': file_instance, 'data': original_data, 'payload': bytes_data}
 
     yield make_dropbox_file
@@ -0,0 +1,191 @@
+'''
+An in-memory stand in for the dropbox client, so tests can run
+without network access or an api token
+'''
+
+import io
+import datetime
+import itertools
+import posixpath
+from typing import Dict, List, Tuple
+
+import dropbox
+from dropbox.files import FileMetadata, FolderMetadata, DeletedMetadata, ListFolderResult
+
+from ..dropboxfile import _dropbox_content_hash
+
+
+class MockResponse:
+    '''
+    Mimics the parts of a requests response used by downloads
+    '''
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    def close(self):
+        self.raw.close()
+
+
+class MockDropbox:
+    '''
+    Implements the dropbox client calls used by the package,
+    backed by a dict of file contents. Every change is appended
+    to a log and cursors are positions in that log
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self._files: Dict[str, bytes] = {}
+        self._folders = set()
+        self._log: List = []
+        self._sessions: Dict[str, bytearray] = {}
+        self._session_ids = itertools.count()  # next() is atomic, sessions start on threads
+        self._generation = 0
+
+    def expire_cursors(self) -> None:
+        '''
+        Makes every cursor handed out so far return a reset error
+        '''
+        self._generation += 1
+
+    # Helpers
+
+    def _metadata(self, path: str) -> FileMetadata:
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        data = self._files[path]
+        return FileMetadata(
+            name=posixpath.basename(path),
+            id='id:{}'.format(path),
+            client_modified=now,
+            server_modified=now,
+            rev='{:09x}'.format(len(self._log) + 1),
+            size=len(data),
+            path_lower=path,
+            path_display=path,
+            content_hash=_dropbox_content_hash(data)
+        )
+
+    def _write(self, path: str, data: bytes) -> FileMetadata:
+        path = path.lower()
+        self._files[path] = bytes(data)
+        metadata = self._metadata(path)
+        self._log.append(metadata)
+        return metadata
+
+    def _remove(self, path: str) -> None:
+        for p in [p for p in self._files if p == path or p.startswith(path + '/')]:
+            del self._files[p]
+            self._log.append(DeletedMetadata(name=posixpath.basename(p), path_lower=p, path_display=p))
+
+        self._folders = {f for f in self._folders if f != path and not f.startswith(path + '/')}
+
+    def _lookup(self, path: str) -> bytes:
+        try:
+            return self._files[path.lower()]
+        except KeyError:
+            raise dropbox.exceptions.ApiError(
+                'mock', dropbox.files.GetMetadataError.path(dropbox.files.LookupError.not_found), None, None)
+
+    # Files
+
+    def files_upload(self, data, path, mode=None, **kwargs):
+        return self._write(path, data)
+
+    def files_download(self, path, **kwargs):
+        data = self._lookup(path)
+        return self._metadata(path.lower()), MockResponse(data)
+
+    def files_get_metadata(self, path, **kwargs):
+        if path.lower() in self._folders:
+            path = path.lower()
+            return FolderMetadata(name=posixpath.basename(path), path_lower=path, path_display=path)
+        self._lookup(path)
+        return self._metadata(path.lower())
+
+    def files_move_v2(self, from_path, to_path, **kwargs):
+        data = self._lookup(from_path)
+        self._remove(from_path.lower())
+        return dropbox.files.RelocationResult(metadata=self._write(to_path, data))
+
+    def files_copy_v2(self, from_path, to_path, **kwargs):
+        if to_path.lower() in self._files:
+            raise dropbox.exceptions.ApiError('mock', 'to/conflict', None, None)
+        data = self._lookup(from_path)
+        return dropbox.files.RelocationResult(metadata=self._write(to_path, data))
+
+    def files_delete_v2(self, path, **kwargs):
+        path = path.lower()
+        if path not in self._files and path not in self._folders:
+            self._lookup(path)
+        self._remove(path)
+
+    # Upload sessions
+
+    def files_upload_session_start(self, data, close=False, **kwargs):
+        session_id = 'session:{}'.format(next(self._session_ids))
+        self._sessions[session_id] = bytearray(data)
+        return dropbox.files.UploadSessionStartResult(session_id=session_id)
+
+    def files_upload_session_append_v2(self, data, cursor, close=False, **kwargs):
+        self._session_buffer(cursor).extend(data)
+
+    def files_upload_session_finish(self, data, cursor, commit, **kwargs):
+        buffer = self._session_buffer(cursor)
+        del self._sessions[cursor.session_id]
+        buffer.extend(data)
+        return self._write(commit.path, buffer)
+
+    def _session_buffer(self, cursor) -> bytearray:
+        # Like dropbox, data must be sent at the offset the session has reached
+        buffer = self._sessions[cursor.session_id]
+        if len(buffer) != cursor.offset:
+            raise dropbox.exceptions.ApiError('mock', 'incorrect_offset', None, None)
+        return buffer
+
+    def files_upload_session_finish_batch_v2(self, entries, **kwargs):
+        results = []
+        for e in entries:
+            data = self._sessions.pop(e.cursor.session_id)
+            if e.commit.path.lower() in self._folders:
+                error = dropbox.files.UploadSessionFinishError.path(
+                    dropbox.files.WriteError.conflict(dropbox.files.WriteConflictError.folder))
+                results.append(dropbox.files.UploadSessionFinishBatchResultEntry.failure(error))
+            else:
+                results.append(dropbox.files.UploadSessionFinishBatchResultEntry.success(
+                    self._write(e.commit.path, data)))
+        return dropbox.files.UploadSessionFinishBatchResult(entries=results)
+
+    # Folders
+
+    def files_create_folder_v2(self, path, **kwargs):
+        path = path.lower()
+        if path in self._folders:
+            raise dropbox.exceptions.ApiError('mock', 'path/conflict/folder', None, None)
+        self._folders.add(path)
+        self._log.append(FolderMetadata(name=posixpath.basename(path), path_lower=path, path_display=path))
+
+    def files_list_folder(self, path, **kwargs):
+        path = path.lower()
+        entries = [self._metadata(p) for p in self._files if posixpath.dirname(p) == path]
+        return ListFolderResult(entries=entries, cursor=self._cursor(path), has_more=False)
+
+    def files_list_folder_continue(self, cursor, **kwargs):
+        path, position = self._read_cursor(cursor, dropbox.files.ListFolderContinueError.reset)
+        entries = [e for e in self._log[position:]
+                   if e.path_lower.startswith(path + '/')]
+        return ListFolderResult(entries=entries, cursor=self._cursor(path), has_more=False)
+
+    def files_list_folder_longpoll(self, cursor, timeout=30, **kwargs):
+        path, position = self._read_cursor(cursor, dropbox.files.ListFolderLongpollError.reset)
+        changes = any(e.path_lower.startswith(path + '/') for e in self._log[position:])
+        return dropbox.files.ListFolderLongpollResult(changes=changes)
+
+    def _cursor(self, path: str) -> str:
+        return '{}:{}:{}'.format(path, self._generation, len(self._log))
+
+    def _read_cursor(self, cursor: str, reset_error) -> Tuple[str, int]:
+        path, generation, position = cursor.rsplit(':', 2)
+        if int(generation) != self._generation:
+            raise dropbox.exceptions.ApiError('mock', reset_error, None, None)
+        return path, int(position)
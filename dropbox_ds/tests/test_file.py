@@ -6,12 +6,18 @@ import datetime
 import posixpath
 
 import pytest
+import pandas as pd
 
-from .. import dropboxfile
+from .. import dropboxfile, exceptions
 
 
 # A factory for fixture types
 
+@pytest.fixture(scope='function')
+def folder_instance(module_folder):
+    # File tests only touch their own paths, so the module shares one folder
+    return module_folder
+
 
 @pytest.fixture(scope='function')
 def csv_config():
@@ -72,10 +78,9 @@ class TestDropboxFile:
         text_file.upload(text_payload)
         csv_file.upload(csv_payload)
         excel_file.upload(excel_payload)
-        text_downloaded = text_file.download()
-        csv_downloaded = csv_file.download(csv_config)
+        text_downloaded, csv_downloaded, excel_downloaded = dropboxfile.download_many(
+            [text_file, csv_file, excel_file], [None, csv_config, excel_config])
 
-        excel_downloaded = excel_file.download(excel_config)
         first, second = excel_downloaded
         merged_df = first.merge(second, left_index=True,
                                 right_index=True, how='outer')
@@ -102,7 +107,7 @@ class TestDropboxFile:
 
         text_file.upload(text_payload)
         path = text_file.path
-        new_path = posixpath.join(posixpath.dirname(path), 'test_2')
+        new_path = posixpath.join(posixpath.dirname(path), 'test_copy')
         new_file = dropboxfile.make_dropbox_file(new_path, api_token)
 
         text_file.copy(new_path)
@@ -118,3 +123,188 @@ class TestDropboxFile:
         assert isinstance(text_file.path, str)
         assert isinstance(text_file.content_hash, str)
         assert isinstance(text_file.last_modified, datetime.datetime)
+
+    def test_download_many(self, dropbox_file, csv_config):
+        text_data = dropbox_file('test.txt')
+        csv_data = dropbox_file('test.csv')
+        text_data['file'].upload(text_data['payload'])
+        csv_data['file'].upload(csv_data['payload'])
+
+        text_downloaded, csv_downloaded = dropboxfile.download_many(
+            [text_data['file'], csv_data['file']], [None, csv_config])
+
+        assert text_downloaded == text_data['data']
+        assert csv_downloaded.equals(csv_data['data'])
+
+    def test_upload_many_clients(self, dropbox_file, mock_client):
+        text_data = dropbox_file('test.txt')
+        text_file = text_data['file']
+        other_file = dropboxfile.make_dropbox_file(text_file.path, api_token='other_token')
+        assert other_file._client is not text_file._client
+
+        dropboxfile.upload_many([
+            (text_file, text_data['payload']),
+            (other_file, b'other account')
+        ])
+        assert text_file.download() == text_data['data']
+        assert other_file.download() == 'other account'
+
+    def test_upload_many_too_large(self, dropbox_file, monkeypatch):
+        text_data = dropbox_file('too_large.txt')
+        csv_data = dropbox_file('too_large.csv')
+        monkeypatch.setattr(dropboxfile, 'UPLOAD_SIZE_LIMIT', len(text_data['payload']))
+
+        with pytest.raises(exceptions.DropboxFileError):
+            dropboxfile.upload_many([
+                (text_data['file'], text_data['payload']),
+                (csv_data['file'], csv_data['payload'])
+            ])
+        assert not text_data['file'].exists(force=True)
+
+    def test_upload_many_partial_failure(self, dropbox_file, client):
+        first_data = dropbox_file('partial_1.txt')
+        blocked_data = dropbox_file('partial_blocked.txt')
+        last_data = dropbox_file('partial_2.txt')
+        client.files_create_folder_v2(blocked_data['file'].path)  # Can't be overwritten by a file
+
+        with pytest.raises(exceptions.DropboxFileError, match='partial_blocked.txt'):
+            dropboxfile.upload_many([
+                (first_data['file'], first_data['payload']),
+                (blocked_data['file'], blocked_data['payload']),
+                (last_data['file'], last_data['payload'])
+            ])
+        for data in (first_data, last_data):
+            assert data['file']._last_modified is not None  # Set from the batch result
+            assert data['file'].download() == data['data']
+
+    def test_download_csv_pyarrow(self, dropbox_file):
+        pytest.importorskip('pyarrow')
+        csv_data = dropbox_file('test.csv')
+        csv_file = csv_data['file']
+        csv_file.upload(csv_data['payload'])
+
+        # Like usecols, positions are read in file order and repeats are dropped
+        csv_downloaded = csv_file.download(dropboxfile.CsvConfig(engine='pyarrow', cols=[2, 1, 2]))
+        assert list(csv_downloaded.columns) == ['a', 'b']
+        assert csv_downloaded.equals(csv_data['data'][['a', 'b']])
+
+    def test_download_csv_pyarrow_missing(self, dropbox_file, monkeypatch):
+        csv_data = dropbox_file('test.csv')
+        csv_file = csv_data['file']
+        csv_file.upload(csv_data['payload'])
+        monkeypatch.setattr(dropboxfile, 'HAS_PYARROW', False)
+
+        engines = []
+        read_csv = pd.read_csv
+
+        def record_engine(*args, **kwargs):
+            engines.append(kwargs.get('engine'))
+            return read_csv(*args, **kwargs)
+
+        monkeypatch.setattr(pd, 'read_csv', record_engine)
+        csv_downloaded = csv_file.download(dropboxfile.CsvConfig(engine='pyarrow', cols=[1, 2]))
+        assert engines == [None]
+        assert csv_downloaded.equals(csv_data['data'][['a', 'b']])
+
+    def test_exists_folder(self, dropbox_file, client):
+        text_file = dropbox_file('folder.txt')['file']
+        client.files_create_folder_v2(text_file.path)
+
+        with pytest.raises(exceptions.DropboxFileError):
+            text_file.exists()
+
+    def test_download_csv_newlines(self, dropbox_file):
+        csv_file = dropbox_file('newlines.csv')['file']
+        csv_file.upload(b'a,b\r\n"line 1\r\nline 2",1\r\n')
+
+        csv_downloaded = csv_file.download(dropboxfile.CsvConfig())
+        assert csv_downloaded['a'][0] == 'line 1\r\nline 2'
+
+    def test_download_csv_invalid(self, dropbox_file):
+        csv_file = dropbox_file('invalid.csv')['file']
+        csv_file.upload(b'a,b\n\xff\xfe,1\n')
+
+        with pytest.raises(exceptions.DropboxFileError):
+            csv_file.download(dropboxfile.CsvConfig())
+
+    def test_download_many_configs(self, dropbox_file, csv_config):
+        text_file = dropbox_file('test.txt')['file']
+        csv_file = dropbox_file('test.csv')['file']
+
+        with pytest.raises(ValueError):
+            dropboxfile.download_many([text_file, csv_file], [csv_config])
+
+    def test_download_dtype(self, dropbox_file, csv_config):
+        csv_data = dropbox_file('test.csv')
+        csv_file = csv_data['file']
+        csv_file.upload(csv_data['payload'])
+
+        csv_config.dtype = {'a': 'float64'}
+        csv_downloaded = csv_file.download(csv_config)
+        assert csv_downloaded['a'].dtype == 'float64'
+        assert csv_downloaded['b'].dtype == csv_data['data']['b'].dtype
+
+    def test_upload_unchanged(self, dropbox_file, monkeypatch):
+        text_data = dropbox_file('test.txt')
+        text_file = text_data['file']
+        text_payload = text_data['payload']
+
+        client = text_file._client
+        files_upload = client.files_upload
+        uploads = []
+
+        def counted_upload(data, *args, **kwargs):
+            uploads.append(data)
+            return files_upload(data, *args, **kwargs)
+
+        monkeypatch.setattr(client, 'files_upload', counted_upload)
+
+        text_file.upload(text_payload)
+        text_file.upload(text_payload)
+        assert uploads == [text_payload]
+
+        text_file.upload(b'modified content')
+        assert uploads == [text_payload, b'modified content']
+
+    @pytest.mark.parametrize('size', [15, 16])
+    def test_upload_session(self, dropbox_file, monkeypatch, size):
+        monkeypatch.setattr(dropboxfile, 'UPLOAD_SIZE_LIMIT', 8)
+        monkeypatch.setattr(dropboxfile, 'UPLOAD_CHUNK_SIZE', 4)
+        text_file = dropbox_file('session.txt')['file']
+        payload = bytes(ord('a') + i for i in range(size))
+
+        client = text_file._client
+        append = client.files_upload_session_append_v2
+        appended = []
+
+        def counted_append(data, cursor, *args, **kwargs):
+            appended.append((bytes(data), cursor.offset))
+            return append(data, cursor, *args, **kwargs)
+
+        monkeypatch.setattr(client, 'files_upload_session_append_v2', counted_append)
+
+        text_file.upload(payload)
+        assert appended == [(payload[4:8], 4), (payload[8:12], 8)]
+        assert text_file.content_hash == dropboxfile._dropbox_content_hash(payload)
+        assert text_file.download() == payload.decode('utf8')
+
+    def test_content_hash(self):
+        # Dropbox hashes each 4MB block, then hashes the concatenated block digests
+        assert dropboxfile._dropbox_content_hash(b'') == \
+            'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+        assert dropboxfile._dropbox_content_hash(b'a' * (dropboxfile.HASH_BLOCK_SIZE + 1)) == \
+            '5f858b62ccd88447586305aec6fd53c96747cfebf527cbba129a6dfed47d9624'
+
+    def test_upload_many(self, dropbox_file):
+        text_data = dropbox_file('test.txt')
+        csv_data = dropbox_file('test.csv')
+        text_file = text_data['file']
+        csv_file = csv_data['file']
+
+        dropboxfile.upload_many([
+            (text_file, text_data['payload']),
+            (csv_file, csv_data['payload'])
+        ])
+        assert text_file.exists(force=True)
+        assert csv_file.exists(force=True)
+        assert text_file.download() == text_data['data']
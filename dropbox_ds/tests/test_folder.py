@@ -2,8 +2,12 @@
 Test dropbox folder operations
 '''
 
+import json
 import posixpath
-from .. import dropboxfile, dropboxfolder
+
+import pytest
+
+from .. import dropboxfile, dropboxfolder, exceptions
 
 
 class TestUpdateFolder:
@@ -86,24 +90,49 @@ class TestUpdateFolder:
         assert set(flist_1) - set(flist_2) == set()
         assert c1 != c2
 
+    def test_restore_state(self, folder_instance, dropbox_file, api_token, tmp_path):
+        state_path = str(tmp_path / 'state.json')
+        folder = dropboxfolder.DropboxFolder(folder_instance.path, api_token, state_path=state_path)
+        upload_files(dropbox_file)
+        folder.update()
 
-def upload_files(dropbox_file):
-    text_data = dropbox_file('test.txt')
-    excel_data = dropbox_file('test.xlsx')
-    csv_data = dropbox_file('test.csv')
+        restored = dropboxfolder.DropboxFolder(folder_instance.path, api_token, state_path=state_path)
+        assert restored.cursor == folder.cursor
+        assert sorted(restored.flist) == sorted(folder.flist)
+
+    def test_restore_state_other_folder(self, folder_instance, api_token, tmp_path):
+        state_path = str(tmp_path / 'state.json')
+        folder = dropboxfolder.DropboxFolder(folder_instance.path, api_token, state_path=state_path)
+        folder.update()
 
-    text_data = dropbox_file('test.txt')
-    text_file = text_data['file']
-    text_payload = text_data['payload']
+        with pytest.raises(exceptions.DropboxFolderError):
+            dropboxfolder.DropboxFolder('/ai/other', api_token, state_path=state_path)
 
-    csv_data = dropbox_file('test.csv')
-    csv_file = csv_data['file']
-    csv_payload = csv_data['payload']
+    def test_restore_state_missing_keys(self, folder_instance, api_token, tmp_path):
+        state_path = tmp_path / 'state.json'
+        state_path.write_text(json.dumps({'path': folder_instance.path}))
 
-    excel_data = dropbox_file('test.xlsx')
-    excel_file = excel_data['file']
-    excel_payload = excel_data['payload']
+        with pytest.raises(exceptions.DropboxFolderError):
+            dropboxfolder.DropboxFolder(folder_instance.path, api_token, state_path=str(state_path))
 
-    text_file.upload(text_payload)
-    csv_file.upload(csv_payload)
-    excel_file.upload(excel_payload)
+    def test_cursor_reset(self, folder_instance, dropbox_file, mock_client):
+        upload_files(dropbox_file)
+        folder_instance.update()
+        flist_1 = folder_instance.flist
+        c1 = folder_instance.cursor
+
+        mock_client.expire_cursors()
+        first, *rest = flist_1
+        first.delete()
+        folder_instance.update()
+
+        assert folder_instance.cursor != c1
+        assert sorted(folder_instance.flist) == sorted(rest)
+
+
+def upload_files(dropbox_file):
+    # Committed together in one batch rather than one upload call per file
+    dropboxfile.upload_many([
+        (data['file'], data['payload']) for data in
+        map(dropbox_file, ['test.txt', 'test.csv', 'test.xlsx'])
+    ])
@@ -0,0 +1,102 @@
+'''
+Test dropbox monitor
+'''
+
+import posixpath
+
+import pytest
+import requests
+
+from .. import exceptions, monitor
+
+
+class StopWatching(Exception):
+    pass
+
+
+def stop_on_emit(emitted):
+
+    def emit(cursor, flist):
+        emitted.append(flist)
+        raise StopWatching()
+
+    return emit
+
+
+class TestDropboxMonitor:
+
+    def test_longpoll_error(self, folder_instance, mock_client, monkeypatch):
+        delays = []
+        monkeypatch.setattr(monitor.time, 'sleep', delays.append)
+
+        path = posixpath.join(folder_instance.path, 'test.txt')
+        longpoll = mock_client.files_list_folder_longpoll
+        calls = []
+
+        def flaky_longpoll(cursor, **kwargs):
+            calls.append(cursor)
+            if len(calls) == 1:
+                raise requests.exceptions.ConnectionError('Connection reset')
+            mock_client.files_upload(b'data', path)
+            return longpoll(cursor, **kwargs)
+
+        monkeypatch.setattr(mock_client, 'files_list_folder_longpoll', flaky_longpoll)
+
+        emitted = []
+        dropbox_monitor = monitor.DropboxMonitor(folder_instance.path, stop_on_emit(emitted))
+        with pytest.raises(exceptions.DropboxMonitorError):
+            dropbox_monitor.watch()
+
+        assert len(calls) == 2
+        assert len(delays) == 1
+        assert [f.path for f in emitted[0]] == [path]
+
+    def test_longpoll_reset(self, folder_instance, mock_client, monkeypatch):
+        delays = []
+        monkeypatch.setattr(monitor.time, 'sleep', delays.append)
+
+        path = posixpath.join(folder_instance.path, 'test.txt')
+        longpoll = mock_client.files_list_folder_longpoll
+
+        def expiring_longpoll(cursor, **kwargs):
+            mock_client.expire_cursors()
+            return longpoll(cursor, **kwargs)
+
+        monkeypatch.setattr(mock_client, 'files_list_folder_longpoll', expiring_longpoll)
+
+        emitted = []
+        dropbox_monitor = monitor.DropboxMonitor(folder_instance.path, stop_on_emit(emitted))
+        mock_client.files_upload(b'data', path)
+        with pytest.raises(exceptions.DropboxMonitorError):
+            dropbox_monitor.watch()
+
+        assert delays == []
+        assert [f.path for f in emitted[0]] == [path]
+
+    def test_error_backoff(self, folder_instance, mock_client, monkeypatch):
+        delays = []
+        monkeypatch.setattr(monitor.time, 'sleep', delays.append)
+
+        path = posixpath.join(folder_instance.path, 'test.txt')
+        longpoll = mock_client.files_list_folder_longpoll
+        failures = 9
+        calls = []
+
+        def failing_longpoll(cursor, **kwargs):
+            calls.append(cursor)
+            if len(calls) <= failures:
+                raise requests.exceptions.ConnectionError('Connection reset')
+            mock_client.files_upload(b'data', path)
+            return longpoll(cursor, **kwargs)
+
+        monkeypatch.setattr(mock_client, 'files_list_folder_longpoll', failing_longpoll)
+
+        dropbox_monitor = monitor.DropboxMonitor(folder_instance.path, stop_on_emit([]))
+        with pytest.raises(exceptions.DropboxMonitorError):
+            dropbox_monitor.watch()
+
+        # Delays double from ERROR_DELAY up to MAX_ERROR_DELAY, plus up to half again as jitter
+        expected = [min(monitor.ERROR_DELAY * 2 ** i, monitor.MAX_ERROR_DELAY) for i in range(failures)]
+        assert expected[-1] == monitor.MAX_ERROR_DELAY
+        assert len(delays) == failures
+        assert all(e <= d <= e * 1.5 for d, e in zip(delays, expected))
@@ -22,9 +22,13 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     install_requires=[
-        'dropbox>=9.4.0',
+        'dropbox>=11.21.0',
         'pandas>=0.25.3',
         'xlrd>=1.2.0'
     ],
+    extras_require={
+        'pyarrow': ['pandas>=1.4.0', 'pyarrow'],
+        'calamine': ['pandas>=2.2.0', 'python-calamine']
+    },
     python_requires='>=3.7'
 )